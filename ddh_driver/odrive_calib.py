@@ -1,3 +1,4 @@
+import argparse
 import time
 
 import odrive
@@ -110,10 +111,22 @@ def calibrate_odrive(sn, name):
         print('Calibration Skipped')
 
 
+def recalibrate_odrive(sn, name):
+    # keeps the current configuration, only calibrates axes that are not pre_calibrated
+    calibrate_motors(sn, name)
+    ask_for_reboot(sn)
+    arm_motors(sn)
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calibrate both ODrives of the hand.')
+    parser.add_argument('--calibrate-only', action='store_true',
+                        help='calibrate without erasing and restoring the ODrive configuration')
+    args = parser.parse_args()
     config = load_ddh_config('default')
     SN_R = dpath.get(config, 'odrive_serial/R')
     SN_L = dpath.get(config, 'odrive_serial/L')
-    calibrate_odrive(SN_R, 'R')
-    calibrate_odrive(SN_L, 'L')
+    calibrate = recalibrate_odrive if args.calibrate_only else calibrate_odrive
+    calibrate(SN_R, 'R')
+    calibrate(SN_L, 'L')
     print('ODrive Calibration Complete!')
@@ -0,0 +1,305 @@
+import argparse
+import json
+import math
+import sys
+from collections import OrderedDict
+
+import odrive
+from odrive.enums import *
+import fibre
+import dpath.util as dpath
+from ddh_driver.utils import *
+
+DEFAULT_PROFILE = 'odrive_config/GB54-2.json'
+
+# results of motor/encoder calibration, provisioning must not overwrite them
+CALIBRATION_KEYS = (
+    'motor.config.phase_inductance',
+    'motor.config.phase_resistance',
+    'motor.config.direction',
+    'motor.config.pre_calibrated',
+    'encoder.config.offset',
+    'encoder.config.offset_float',
+    'encoder.config.pre_calibrated',
+    'anticogging.pre_calibrated',
+)
+
+PRE_CALIBRATED_KEYS = (
+    'motor.config.pre_calibrated',
+    'encoder.config.pre_calibrated',
+    'controller.config.anticogging.pre_calibrated',
+)
+
+# changing these makes the stored calibration of the axis invalid
+INVALIDATE_CALIBRATION_KEYS = (
+    'encoder.config.mode',
+    'encoder.config.cpr',
+    'motor.config.pole_pairs',
+    'motor.config.motor_type',
+)
+
+# settings only picked up by the firmware at boot
+REBOOT_KEYS = (
+    'config.enable_uart',
+    'config.uart_baudrate',
+    'config.enable_i2c_instead_of_can',
+    'config.enable_ascii_protocol_on_usb',
+    'config.brake_resistance',
+    'can.config.baud_rate',
+    'can.config.protocol',
+    'config.can_node_id',
+    'config.can_node_id_extended',
+    'config.enable_step_dir',
+    'config.step_gpio_pin',
+    'config.dir_gpio_pin',
+    'encoder.config.mode',
+    'encoder.config.cpr',
+    'encoder.config.abs_spi_cs_gpio_pin',
+    'encoder.config.sincos_gpio_pin_sin',
+    'encoder.config.sincos_gpio_pin_cos',
+    'motor.config.motor_type',
+    'motor.config.pole_pairs',
+    'motor.config.requested_current_range',
+    'min_endstop.config.gpio_num',
+    'min_endstop.config.pullup',
+    'max_endstop.config.gpio_num',
+    'max_endstop.config.pullup',
+    'motor_thermistor.config.gpio_pin',
+)
+
+# from this firmware on save_configuration() reboots the board, dropping the USB connection
+SAVE_REBOOTS_FW_VERSION = (0, 5, 2)
+
+STATUS_UNCHANGED = 'unchanged'
+STATUS_DRY_RUN = 'dry run'
+STATUS_PROVISIONED = 'provisioned'
+STATUS_REFUSED = 'refused, axes not idle'
+STATUS_REJECTED = 'writes rejected'
+STATUS_SAVE_FAILED = 'save failed'
+STATUS_UNCONFIRMED = 'save unconfirmed'
+STATUS_DISCONNECTED = 'disconnected'
+SUCCESS_STATUSES = (STATUS_UNCHANGED, STATUS_DRY_RUN, STATUS_PROVISIONED)
+
+
+def _matches(path, keys):
+    return any(path == k or path.endswith('.' + k) for k in keys)
+
+
+def is_calibration_key(path):
+    return _matches(path, CALIBRATION_KEYS)
+
+
+def needs_reboot(path):
+    return _matches(path, REBOOT_KEYS) or '_mapping.' in path
+
+
+def load_profile(profile_path):
+    with open(get_abs_path(profile_path), 'r') as f:
+        return json.load(f)
+
+
+def flatten_config(config, prefix=''):
+    flat = OrderedDict()
+    for key, value in config.items():
+        path = prefix + '.' + key if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten_config(value, path))
+        else:
+            flat[path] = value
+    return flat
+
+
+def group_by_parent(paths):
+    # each property read/write is still one USB transfer, grouping only avoids
+    # walking the same parent path (axis0.motor.config, ...) once per key
+    groups = OrderedDict()
+    for path in paths:
+        parent, _, attr = path.rpartition('.')
+        groups.setdefault(parent, []).append(attr)
+    return groups
+
+
+def resolve(obj, path):
+    for attr in path.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def read_config(od, paths):
+    current = OrderedDict()
+    missing = []
+    for parent, attrs in group_by_parent(paths).items():
+        try:
+            node = resolve(od, parent)
+        except AttributeError:
+            missing.extend(parent + '.' + attr for attr in attrs)
+            continue
+        for attr in attrs:
+            try:
+                current[parent + '.' + attr] = getattr(node, attr)
+            except AttributeError:
+                missing.append(parent + '.' + attr)
+    return current, missing
+
+
+def values_equal(current, target):
+    if isinstance(target, float) or isinstance(current, float):
+        return math.isclose(float(current), float(target), rel_tol=1e-6, abs_tol=1e-9)
+    return current == target
+
+
+def diff_config(current, target):
+    return [(path, current[path], value) for path, value in target.items()
+            if path in current and not values_equal(current[path], value)]
+
+
+def invalidated_axes(changes):
+    axes = []
+    for path, _, _ in changes:
+        axis = path.split('.')[0]
+        if _matches(path, INVALIDATE_CALIBRATION_KEYS) and axis not in axes:
+            axes.append(axis)
+    return axes
+
+
+def write_config(od, changes):
+    targets = dict((path, value) for path, _, value in changes)
+    rejected = []
+    for parent, attrs in group_by_parent(targets.keys()).items():
+        try:
+            node = resolve(od, parent)
+        except AttributeError as e:
+            rejected.extend((parent + '.' + attr, e) for attr in attrs)
+            continue
+        for attr in attrs:
+            try:
+                setattr(node, attr, targets[parent + '.' + attr])
+            except fibre.ObjectLostError:
+                raise
+            except Exception as e:
+                rejected.append((parent + '.' + attr, e))
+    return rejected
+
+
+def verify_config(od, changes):
+    current, missing = read_config(od, [path for path, _, _ in changes])
+    target = OrderedDict((path, value) for path, _, value in changes)
+    return [path for path, _, _ in diff_config(current, target)] + missing
+
+
+def saves_with_reboot(od):
+    version = tuple(getattr(od, 'fw_version_' + v, 0) for v in ('major', 'minor', 'revision'))
+    return version >= SAVE_REBOOTS_FW_VERSION
+
+
+def axes_idle(od):
+    return od.axis0.current_state == AXIS_STATE_IDLE and od.axis1.current_state == AXIS_STATE_IDLE
+
+
+def print_report(od_name, changes, missing=(), unchecked=(), invalidated=()):
+    if changes:
+        print('ODrive_%s: %d key(s) differ from the profile' % (od_name, len(changes)))
+    else:
+        print('\033[92mODrive_%s matches the profile\033[0m' % od_name)
+    for path, current, target in changes:
+        print('  %s%s: %r -> %r' % ('[reboot] ' if needs_reboot(path) else '', path, current, target))
+    for path in missing:
+        print('  [skipped] %s: not available on this firmware' % path)
+    for path in unchecked:
+        print('  [not checked] %s: endpoint mapping' % path)
+    for axis in invalidated:
+        print('\033[93mODrive_%s %s: calibration invalidated, run python3 -m ddh_driver.odrive_calib --calibrate-only afterwards\033[0m'
+              % (od_name, axis))
+
+
+def provision_odrive(sn, od_name, profile_path=DEFAULT_PROFILE, dry_run=False, keep_calibration=True):
+    target = flatten_config(load_profile(profile_path))
+    # endpoint references are stored as null in the profile and cannot be compared or written back
+    unchecked = [p for p, v in target.items() if v is None]
+    target = OrderedDict((p, v) for p, v in target.items() if v is not None)
+    if keep_calibration:
+        target = OrderedDict((p, v) for p, v in target.items() if not is_calibration_key(p))
+    od = odrive.find_any(serial_number=sn)
+    current, missing = read_config(od, target.keys())
+    changes = diff_config(current, target)
+    invalidated = invalidated_axes(changes) if keep_calibration else []
+    if invalidated:
+        # stale offsets and phase R/L must not be reused, force recalibration
+        flags, flags_missing = read_config(od, [axis + '.' + k for axis in invalidated for k in PRE_CALIBRATED_KEYS])
+        changes += diff_config(flags, OrderedDict((p, False) for p in flags))
+        missing += flags_missing
+    print_report(od_name, changes, missing, unchecked, invalidated)
+    if dry_run:
+        return STATUS_DRY_RUN if changes else STATUS_UNCHANGED
+    if not changes:
+        return STATUS_UNCHANGED
+    if not axes_idle(od):
+        print('\033[91mODrive_%s: motors are armed, set both axes to idle before provisioning. Nothing written.\033[0m'
+              % od_name)
+        return STATUS_REFUSED
+    try:
+        rejected = write_config(od, changes)
+    except fibre.ObjectLostError:
+        print('\033[91mODrive_%s disconnected while writing, nothing saved\033[0m' % od_name)
+        return STATUS_DISCONNECTED
+    for path, e in rejected:
+        print('\033[91m  [rejected] %s: %s\033[0m' % (path, e))
+    rejected_paths = [path for path, _ in rejected]
+    written = [c for c in changes if c[0] not in rejected_paths]
+    if not written:
+        print('\033[91mODrive_%s: no key written, nothing saved\033[0m' % od_name)
+        return STATUS_REJECTED
+    reboot = any(needs_reboot(path) for path, _, _ in written)
+    save_reboots = saves_with_reboot(od)
+    confirmed, lost = True, False
+    try:
+        saved = od.save_configuration()
+    except fibre.ObjectLostError:
+        saved, reboot, lost = True, True, True
+        confirmed = save_reboots
+    if saved is False:
+        print('\033[91mODrive_%s: save_configuration failed, changes only live in RAM. Power cycle the ODrive and retry\033[0m' % od_name)
+        return STATUS_SAVE_FAILED
+    if confirmed:
+        print('\033[92mODrive_%s configuration saved!\033[0m' % od_name)
+    else:
+        print('\033[93mODrive_%s lost connection during save, save unconfirmed\033[0m' % od_name)
+    if reboot:
+        if not lost:
+            try:
+                od.reboot()
+            except fibre.ObjectLostError:
+                pass
+        print('ODrive_%s rebooting...' % od_name)
+        od = odrive.find_any(serial_number=sn)
+        print('Reconnected!')
+        mismatched = verify_config(od, written)
+        for path in mismatched:
+            print('\033[91m  [not applied] %s\033[0m' % path)
+        if mismatched:
+            return STATUS_SAVE_FAILED
+    if not confirmed:
+        print('\033[93mODrive_%s: values present after reconnect, power cycle and rerun with --dry-run to confirm they persist\033[0m'
+              % od_name)
+        return STATUS_UNCONFIRMED
+    return STATUS_REJECTED if rejected else STATUS_PROVISIONED
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write only the ODrive settings that differ from a JSON profile.')
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, help='profile path relative to the repository root')
+    parser.add_argument('--dry-run', action='store_true', help='report the differences without writing anything')
+    parser.add_argument('--overwrite-calibration', action='store_true',
+                        help='also reset calibration results (offsets, phase resistance, pre_calibrated flags)')
+    args = parser.parse_args()
+    config = load_ddh_config('default')
+    results = OrderedDict()
+    for od_name in ('R', 'L'):
+        results[od_name] = provision_odrive(dpath.get(config, 'odrive_serial/' + od_name), od_name, args.profile,
+                                            dry_run=args.dry_run, keep_calibration=not args.overwrite_calibration)
+    for od_name, status in results.items():
+        print('ODrive_%s: %s' % (od_name, status))
+    if any(status not in SUCCESS_STATUSES for status in results.values()):
+        print('\033[91mODrive Provisioning Failed!\033[0m')
+        sys.exit(1)
+    print('ODrive Provisioning Complete!' if not args.dry_run else 'Dry run complete, nothing written.')
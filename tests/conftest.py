@@ -0,0 +1,36 @@
+import importlib.util
+import sys
+import types
+
+
+# the provisioning logic is tested without the ODrive SDK, stand-ins are only
+# installed when the real packages are missing
+MISSING = [name for name in ('odrive', 'fibre', 'dpath', 'numpy') if importlib.util.find_spec(name) is None]
+
+
+def _stand_in(name, **attrs):
+    if name.split('.')[0] not in MISSING:
+        return
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+
+
+class ObjectLostError(Exception):
+    pass
+
+
+def find_any(**kwargs):
+    raise RuntimeError('no ODrive available in tests')
+
+
+_stand_in('odrive', find_any=find_any)
+_stand_in('odrive.enums', AXIS_STATE_IDLE=1, AXIS_STATE_FULL_CALIBRATION_SEQUENCE=3,
+          AXIS_STATE_ENCODER_OFFSET_CALIBRATION=7, AXIS_STATE_CLOSED_LOOP_CONTROL=8)
+_stand_in('fibre', ObjectLostError=ObjectLostError)
+_stand_in('dpath')
+_stand_in('dpath.util')
+_stand_in('numpy', deg2rad=None, rad2deg=None)
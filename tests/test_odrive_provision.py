@@ -0,0 +1,209 @@
+import copy
+import math
+from collections import OrderedDict
+
+import pytest
+
+import ddh_driver.odrive_provision as provision
+from ddh_driver.odrive_provision import *
+
+
+class FakeNode(object):
+
+    def __init__(self, writes, path, config):
+        self.__dict__.update(_writes=writes, _path=path)
+        for key, value in config.items():
+            self.__dict__[key] = FakeNode(writes, path + key + '.', value) if isinstance(value, dict) else value
+
+    def __setattr__(self, key, value):
+        if key not in self.__dict__:
+            raise AttributeError(key)
+        self._writes.append(self._path + key)
+        self.__dict__[key] = value
+
+
+class FakeODrive(FakeNode):
+
+    def __init__(self, config):
+        FakeNode.__init__(self, [], '', config)
+        self.__dict__.update(saves=0, reboots=0, save_result=True)
+
+    @property
+    def writes(self):
+        return self._writes
+
+    def save_configuration(self):
+        self.__dict__['saves'] += 1
+        return self.save_result
+
+    def reboot(self):
+        self.__dict__['reboots'] += 1
+
+
+def set_on(od, path, value):
+    parent, _, attr = path.rpartition('.')
+    resolve(od, parent).__dict__[attr] = value
+
+
+@pytest.fixture
+def od(monkeypatch):
+    config = copy.deepcopy(load_profile(DEFAULT_PROFILE))
+    for axis in ('axis0', 'axis1'):
+        config[axis]['current_state'] = AXIS_STATE_IDLE
+        config[axis]['motor']['config'].update(pre_calibrated=True, phase_resistance=0.1, phase_inductance=1e-5)
+        config[axis]['encoder']['config'].update(pre_calibrated=True, offset=1234, offset_float=0.5)
+    board = FakeODrive(config)
+    monkeypatch.setattr(provision.odrive, 'find_any', lambda **kwargs: board)
+    return board
+
+
+def test_flatten_config_keeps_endpoint_mappings():
+    flat = flatten_config({'axis0': {'motor': {'config': {'pole_pairs': 7}}},
+                           'config': {'gpio1_pwm_mapping': {'endpoint': None, 'max': 0.0}}})
+    assert list(flat.items()) == [('axis0.motor.config.pole_pairs', 7),
+                                  ('config.gpio1_pwm_mapping.endpoint', None),
+                                  ('config.gpio1_pwm_mapping.max', 0.0)]
+
+
+def test_diff_config_float_tolerance():
+    current = OrderedDict([('a.vel_gain', 0.1666666716337204), ('a.torque_lim', math.inf),
+                           ('a.pos_gain', 10.0), ('a.cpr', 8192)])
+    target = OrderedDict([('a.vel_gain', 1.0 / 6.0), ('a.torque_lim', math.inf),
+                          ('a.pos_gain', 20.0), ('a.cpr', 16384), ('a.missing', 1)])
+    assert diff_config(current, target) == [('a.pos_gain', 10.0, 20.0), ('a.cpr', 8192, 16384)]
+
+
+def test_calibration_keys_are_filtered():
+    assert is_calibration_key('axis0.controller.config.anticogging.pre_calibrated')
+    assert is_calibration_key('axis1.motor.config.direction')
+    assert is_calibration_key('axis0.encoder.config.offset_float')
+    assert not is_calibration_key('axis0.min_endstop.config.offset')
+    assert not is_calibration_key('axis0.controller.config.pos_gain')
+
+
+def test_needs_reboot():
+    assert needs_reboot('config.gpio3_analog_mapping.max')
+    assert needs_reboot('can.config.baud_rate')
+    assert needs_reboot('axis1.max_endstop.config.gpio_num')
+    assert not needs_reboot('axis0.controller.config.pos_gain')
+    assert not needs_reboot('axis0.motor.config.current_lim')
+
+
+def test_invalidated_axes():
+    changes = [('axis1.encoder.config.cpr', 8192, 16384), ('axis0.controller.config.pos_gain', 10.0, 20.0),
+               ('axis1.motor.config.pole_pairs', 14, 7)]
+    assert invalidated_axes(changes) == ['axis1']
+
+
+def test_group_by_parent():
+    groups = group_by_parent(['axis0.motor.config.pole_pairs', 'can.config.baud_rate',
+                              'axis0.motor.config.current_lim'])
+    assert groups == OrderedDict([('axis0.motor.config', ['pole_pairs', 'current_lim']),
+                                  ('can.config', ['baud_rate'])])
+
+
+def test_unchanged_board_is_left_alone(od):
+    assert provision_odrive('sn', 'R') == STATUS_UNCHANGED
+    assert od.writes == [] and od.saves == 0 and od.reboots == 0
+
+
+def test_only_differing_keys_are_written(od):
+    set_on(od, 'axis0.controller.config.pos_gain', 10.0)
+    assert provision_odrive('sn', 'R') == STATUS_PROVISIONED
+    assert od.writes == ['axis0.controller.config.pos_gain']
+    assert od.axis0.controller.config.pos_gain == 20.0
+    assert od.saves == 1 and od.reboots == 0
+
+
+def test_reboot_only_for_reboot_keys(od):
+    set_on(od, 'can.config.baud_rate', 1000000)
+    assert provision_odrive('sn', 'R') == STATUS_PROVISIONED
+    assert od.saves == 1 and od.reboots == 1
+
+
+def test_dry_run_writes_nothing(od):
+    set_on(od, 'can.config.baud_rate', 1000000)
+    assert provision_odrive('sn', 'R', dry_run=True) == STATUS_DRY_RUN
+    assert od.writes == [] and od.saves == 0 and od.reboots == 0
+
+
+def test_calibration_is_kept_by_default(od):
+    assert provision_odrive('sn', 'R') == STATUS_UNCHANGED
+    assert od.axis0.motor.config.phase_resistance == 0.1
+    assert provision_odrive('sn', 'R', keep_calibration=False) == STATUS_PROVISIONED
+    assert od.axis0.motor.config.phase_resistance == 0.0
+    assert not od.axis1.encoder.config.pre_calibrated
+
+
+def test_refuses_when_axis_is_armed(od):
+    set_on(od, 'axis0.controller.config.pos_gain', 10.0)
+    set_on(od, 'axis1.current_state', AXIS_STATE_IDLE + 7)
+    assert provision_odrive('sn', 'R') == STATUS_REFUSED
+    assert od.writes == [] and od.saves == 0
+
+
+def test_invalidating_key_clears_pre_calibrated(od):
+    set_on(od, 'axis1.encoder.config.cpr', 8192)
+    assert provision_odrive('sn', 'R') == STATUS_PROVISIONED
+    assert not od.axis1.motor.config.pre_calibrated
+    assert not od.axis1.encoder.config.pre_calibrated
+    assert od.axis1.motor.config.phase_resistance == 0.1
+    assert od.axis0.motor.config.pre_calibrated and od.axis0.encoder.config.pre_calibrated
+
+
+def test_missing_keys_are_skipped(od):
+    del od.can.config.__dict__['protocol']
+    set_on(od, 'axis0.controller.config.pos_gain', 10.0)
+    assert provision_odrive('sn', 'R') == STATUS_PROVISIONED
+
+
+def test_failed_save_is_reported(od):
+    set_on(od, 'axis0.controller.config.pos_gain', 10.0)
+    od.__dict__['save_result'] = False
+    assert provision_odrive('sn', 'R') == STATUS_SAVE_FAILED
+
+
+def test_rejected_write_is_reported(od, monkeypatch):
+    set_on(od, 'axis0.controller.config.pos_gain', 10.0)
+    set_on(od, 'axis0.controller.config.vel_gain', 1.0)
+
+    def reject_pos_gain(node, key, value):
+        if key == 'pos_gain':
+            raise ValueError('rejected')
+        node.__dict__[key] = value
+    monkeypatch.setattr(FakeNode, '__setattr__', reject_pos_gain)
+    assert provision_odrive('sn', 'R') == STATUS_REJECTED
+    assert od.saves == 1
+
+
+def test_disconnect_while_writing_is_not_saved(od, monkeypatch):
+    set_on(od, 'axis0.controller.config.pos_gain', 10.0)
+
+    def lost(node, key, value):
+        raise provision.fibre.ObjectLostError()
+    monkeypatch.setattr(FakeNode, '__setattr__', lost)
+    assert provision_odrive('sn', 'R') == STATUS_DISCONNECTED
+    assert od.saves == 0
+
+
+def test_nothing_saved_when_all_writes_rejected(od, monkeypatch):
+    set_on(od, 'axis0.controller.config.pos_gain', 10.0)
+
+    def reject(node, key, value):
+        raise ValueError('rejected')
+    monkeypatch.setattr(FakeNode, '__setattr__', reject)
+    assert provision_odrive('sn', 'R') == STATUS_REJECTED
+    assert od.saves == 0
+
+
+@pytest.mark.parametrize('fw_version, status', [((0, 5, 1), STATUS_UNCONFIRMED), ((0, 5, 4), STATUS_PROVISIONED)])
+def test_disconnect_on_save(od, monkeypatch, fw_version, status):
+    set_on(od, 'axis0.controller.config.pos_gain', 10.0)
+    od.__dict__.update(fw_version_major=fw_version[0], fw_version_minor=fw_version[1],
+                       fw_version_revision=fw_version[2])
+
+    def save_and_reboot():
+        raise provision.fibre.ObjectLostError()
+    od.__dict__['save_configuration'] = save_and_reboot
+    assert provision_odrive('sn', 'R') == status
+    assert od.reboots == 0